@@ -0,0 +1,421 @@
+import codecs
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+CONFIG_FILE = "config.json"
+
+
+class ConfigError(RuntimeError):
+    """config.json could not be read or has invalid fields; `problems` lists all of them."""
+
+    def __init__(self, path: str, problems: List[str]):
+        self.path = path
+        self.problems = problems
+        super().__init__(f"Invalid {path}:\n" + "\n".join(f"- {p}" for p in problems))
+
+
+@dataclass(frozen=True)
+class Credentials:
+    username: str = ""
+    password: str = ""
+    username_field: str = "username"
+    password_field: str = "password"
+    extra_fields: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+
+
+@dataclass(frozen=True)
+class MatchRule:
+    course_types: Tuple[str, ...] = ()
+    groups: Tuple[str, ...] = ()
+    subjects: Tuple[str, ...] = ()
+
+    def is_empty(self) -> bool:
+        return not (self.course_types or self.groups or self.subjects)
+
+
+@dataclass(frozen=True)
+class CalendarTarget:
+    calendar_id: str = ""
+    calendar_name: str = ""
+    match: MatchRule = MatchRule()
+
+
+@dataclass(frozen=True)
+class RangeParams:
+    from_param: str = ""
+    to_param: str = ""
+    date_format: str = "%Y.%m.%d"
+
+
+@dataclass(frozen=True)
+class OrarendRange:
+    """One entry of orarend_ranges: exactly one of week, from_date/to_date or params is set."""
+
+    week: str = ""
+    from_date: str = ""
+    to_date: str = ""
+    params: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))
+
+
+@dataclass(frozen=True)
+class EmailConfig:
+    enabled: bool = False
+    send_on_failure: bool = False
+    from_addr: str = ""
+    to_addr: str = ""
+    subject_prefix: str = "ELTE órarend sync"
+    credentials_file: str = "credentials.json"
+    token_file: str = "token_gmail.json"
+    outbox_file: str = "data/outbox.jsonl"
+    digest_window_minutes: float = 0.0
+    max_details_per_section: int = 50
+    max_body_chars: int = 50_000
+
+
+@dataclass(frozen=True)
+class Config:
+    timezone: str = "Europe/Budapest"
+    calendar_id: str = ""
+    calendar_name: str = ""
+    calendars: Tuple[CalendarTarget, ...] = ()
+    cookie: str = ""
+    base_url: str = "https://inform.gtk.elte.hu/index.php?site=100"
+    orarend_url: str = ""
+    login_url: str = ""
+    login_start_url: str = ""
+    lecture_group_letter: str = ""
+    credentials: Credentials = Credentials()
+    snapshots_dir: str = "data/snapshots"
+    keep_snapshots: int = 7
+    debug_dir: str = "data/debug"
+    fallback_encoding: str = "cp1250"
+    orarend_ranges: Tuple[OrarendRange, ...] = ()
+    orarend_range_params: RangeParams = RangeParams()
+    orarend_fetch_workers: int = 4
+    email: EmailConfig = EmailConfig()
+
+    def sync_targets(self) -> Tuple[CalendarTarget, ...]:
+        """The routed calendars, or the single calendar_id/calendar_name as one catch-all target."""
+        return self.calendars or (CalendarTarget(self.calendar_id, self.calendar_name),)
+
+    def problems_for_run(self) -> List[str]:
+        """Fields a full main.py run needs but that the schema allows to be empty."""
+        problems = []
+        if not (self.login_url or self.login_start_url or self.orarend_url):
+            problems.append("login_url: set login_url, login_start_url or orarend_url")
+        if not (self.credentials.username and self.credentials.password):
+            problems.append("credentials: username and password are required")
+        if not self.calendars and not (self.calendar_id or self.calendar_name):
+            problems.append("calendar_id: set calendar_id, calendar_name or calendars")
+        if self.email.enabled and not (self.email.from_addr and self.email.to_addr):
+            problems.append("email: from_addr and to_addr are required when email.enabled is true")
+        return problems
+
+
+def strip_json_comments(text: str) -> str:
+    """Remove // and /* */ comments outside of JSON strings (config.example.json uses them)."""
+    out = []
+    i = 0
+    n = len(text)
+    in_string = False
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == "\\" and i + 1 < n:
+                out.append(text[i + 1])
+                i += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+            out.append(c)
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            # Keep newlines so JSON error positions still match the file
+            out.append("\n" * text.count("\n", i, n if end == -1 else end))
+            i = n if end == -1 else end + 2
+            continue
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out)
+
+
+class _Reader:
+    """Typed field access over the raw JSON that collects every problem instead of stopping at the first."""
+
+    def __init__(self, problems: List[str]):
+        self.problems = problems
+
+    def section(self, raw, where: str, known: Tuple[str, ...]) -> Dict:
+        if raw is None:
+            return {}
+        if not isinstance(raw, dict):
+            self.problems.append(f"{where or 'config'}: expected an object")
+            return {}
+        for key in raw:
+            # "_comment" style keys are documentation
+            if key not in known and not key.startswith("_"):
+                self.problems.append(f"{where}{key}: unknown field")
+        return raw
+
+    def get(self, raw: Dict, key: str, typ, default, where: str):
+        value = raw.get(key)
+        if value is None:
+            return default
+        if typ is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        if not isinstance(value, typ) or (typ is int and isinstance(value, bool)):
+            self.problems.append(f"{where}{key}: expected {typ.__name__}, got {type(value).__name__}")
+            return default
+        return value.strip() if isinstance(value, str) else value
+
+    def str_list(self, raw: Dict, key: str, where: str) -> Tuple[str, ...]:
+        value = raw.get(key)
+        if value is None:
+            return ()
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            self.problems.append(f"{where}{key}: expected a list of strings")
+            return ()
+        return tuple(v.strip() for v in value)
+
+    def str_map(self, raw: Dict, key: str, where: str) -> Mapping[str, str]:
+        value = raw.get(key)
+        if value is None:
+            return MappingProxyType({})
+        if not isinstance(value, dict):
+            self.problems.append(f"{where}{key}: expected an object")
+            return MappingProxyType({})
+        return MappingProxyType({str(k): str(v) for k, v in value.items()})
+
+
+def _parse_credentials(r: _Reader, raw) -> Credentials:
+    w = "credentials."
+    raw = r.section(raw, w, ("username", "password", "username_field", "password_field", "extra_fields"))
+    return Credentials(
+        username=r.get(raw, "username", str, "", w),
+        password=r.get(raw, "password", str, "", w),
+        username_field=r.get(raw, "username_field", str, "", w) or "username",
+        password_field=r.get(raw, "password_field", str, "", w) or "password",
+        extra_fields=r.str_map(raw, "extra_fields", w),
+    )
+
+
+def _parse_calendars(r: _Reader, raw) -> Tuple[CalendarTarget, ...]:
+    if raw is None:
+        return ()
+    if not isinstance(raw, list):
+        r.problems.append("calendars: expected a list")
+        return ()
+    targets = []
+    for i, item in enumerate(raw):
+        w = f"calendars[{i}]."
+        if not isinstance(item, dict):
+            r.problems.append(f"calendars[{i}]: expected an object")
+            continue
+        item = r.section(item, w, ("calendar_id", "calendar_name", "match"))
+        match_raw = r.section(item.get("match"), w + "match.", ("course_types", "groups", "subjects"))
+        target = CalendarTarget(
+            calendar_id=r.get(item, "calendar_id", str, "", w),
+            calendar_name=r.get(item, "calendar_name", str, "", w),
+            match=MatchRule(
+                course_types=r.str_list(match_raw, "course_types", w + "match."),
+                groups=r.str_list(match_raw, "groups", w + "match."),
+                subjects=r.str_list(match_raw, "subjects", w + "match."),
+            ),
+        )
+        if not (target.calendar_id or target.calendar_name):
+            r.problems.append(f"calendars[{i}]: set calendar_id or calendar_name")
+        targets.append(target)
+    return tuple(targets)
+
+
+def _parse_ranges(r: _Reader, raw) -> Tuple[OrarendRange, ...]:
+    if raw is None:
+        return ()
+    if not isinstance(raw, list):
+        r.problems.append("orarend_ranges: expected a list")
+        return ()
+    ranges = []
+    for i, item in enumerate(raw):
+        w = f"orarend_ranges[{i}]."
+        if not isinstance(item, dict):
+            r.problems.append(f"orarend_ranges[{i}]: expected an object")
+            continue
+        item = r.section(item, w, ("week", "from", "to", "params"))
+        entry = OrarendRange(
+            week=r.get(item, "week", str, "", w),
+            from_date=r.get(item, "from", str, "", w),
+            to_date=r.get(item, "to", str, "", w),
+            params=r.str_map(item, "params", w),
+        )
+        kinds = sum(bool(x) for x in (entry.week, entry.from_date or entry.to_date, entry.params))
+        if kinds != 1:
+            r.problems.append(f"orarend_ranges[{i}]: set exactly one of week, from/to or params")
+        if entry.week:
+            try:
+                year, week = entry.week.split("-W", 1)
+                date.fromisocalendar(int(year), int(week), 1)
+            except ValueError:
+                r.problems.append(f"{w}week: expected an ISO week like 2026-W37")
+        if entry.to_date and not entry.from_date:
+            r.problems.append(f"{w}from: required when to is set")
+        for key, value in (("from", entry.from_date), ("to", entry.to_date)):
+            if value:
+                try:
+                    date.fromisoformat(value)
+                except ValueError:
+                    r.problems.append(f"{w}{key}: expected a date like 2026-09-01")
+        ranges.append(entry)
+    return tuple(ranges)
+
+
+def _parse_email(r: _Reader, raw) -> EmailConfig:
+    w = "email."
+    defaults = EmailConfig()
+    raw = r.section(
+        raw,
+        w,
+        (
+            "enabled", "send_on_failure", "from_addr", "to_addr", "subject_prefix", "credentials_file",
+            "token_file", "outbox_file", "digest_window_minutes", "max_details_per_section", "max_body_chars",
+        ),
+    )
+    email = EmailConfig(
+        enabled=r.get(raw, "enabled", bool, False, w),
+        send_on_failure=r.get(raw, "send_on_failure", bool, False, w),
+        from_addr=r.get(raw, "from_addr", str, "", w),
+        to_addr=r.get(raw, "to_addr", str, "", w),
+        subject_prefix=r.get(raw, "subject_prefix", str, "", w) or defaults.subject_prefix,
+        credentials_file=r.get(raw, "credentials_file", str, "", w) or defaults.credentials_file,
+        token_file=r.get(raw, "token_file", str, "", w) or defaults.token_file,
+        outbox_file=r.get(raw, "outbox_file", str, "", w) or defaults.outbox_file,
+        digest_window_minutes=r.get(raw, "digest_window_minutes", float, 0.0, w),
+        max_details_per_section=r.get(raw, "max_details_per_section", int, defaults.max_details_per_section, w),
+        max_body_chars=r.get(raw, "max_body_chars", int, defaults.max_body_chars, w),
+    )
+    if email.digest_window_minutes < 0:
+        r.problems.append(f"{w}digest_window_minutes: must be >= 0")
+    if email.max_details_per_section < 0:
+        r.problems.append(f"{w}max_details_per_section: must be >= 0")
+    if email.max_body_chars < 1:
+        r.problems.append(f"{w}max_body_chars: must be >= 1")
+    return email
+
+
+_TOP_LEVEL = (
+    "timezone", "calendar_id", "calendar_name", "calendars", "cookie", "base_url", "orarend_url", "login_url",
+    "login_start_url", "lecture_group_letter", "credentials", "snapshots_dir", "keep_snapshots", "debug_dir",
+    "fallback_encoding", "orarend_ranges", "orarend_range_params", "orarend_fetch_workers", "email",
+)
+
+
+def parse_config(raw, path: str = CONFIG_FILE) -> Config:
+    """Build a Config from decoded JSON, raising ConfigError with every invalid field."""
+    problems: List[str] = []
+    r = _Reader(problems)
+    raw = r.section(raw, "", _TOP_LEVEL)
+    defaults = Config()
+
+    range_raw = r.section(raw.get("orarend_range_params"), "orarend_range_params.", ("from", "to", "date_format"))
+    cfg = Config(
+        timezone=r.get(raw, "timezone", str, "", "") or defaults.timezone,
+        calendar_id=r.get(raw, "calendar_id", str, "", ""),
+        calendar_name=r.get(raw, "calendar_name", str, "", ""),
+        calendars=_parse_calendars(r, raw.get("calendars")),
+        cookie=r.get(raw, "cookie", str, "", ""),
+        base_url=r.get(raw, "base_url", str, "", "") or defaults.base_url,
+        orarend_url=r.get(raw, "orarend_url", str, "", ""),
+        login_url=r.get(raw, "login_url", str, "", ""),
+        login_start_url=r.get(raw, "login_start_url", str, "", ""),
+        lecture_group_letter=r.get(raw, "lecture_group_letter", str, "", ""),
+        credentials=_parse_credentials(r, raw.get("credentials")),
+        snapshots_dir=r.get(raw, "snapshots_dir", str, "", "") or defaults.snapshots_dir,
+        keep_snapshots=r.get(raw, "keep_snapshots", int, defaults.keep_snapshots, ""),
+        debug_dir=r.get(raw, "debug_dir", str, "", "") or defaults.debug_dir,
+        fallback_encoding=r.get(raw, "fallback_encoding", str, "", "") or defaults.fallback_encoding,
+        orarend_ranges=_parse_ranges(r, raw.get("orarend_ranges")),
+        orarend_range_params=RangeParams(
+            from_param=r.get(range_raw, "from", str, "", "orarend_range_params."),
+            to_param=r.get(range_raw, "to", str, "", "orarend_range_params."),
+            date_format=r.get(range_raw, "date_format", str, "", "orarend_range_params.")
+            or RangeParams().date_format,
+        ),
+        orarend_fetch_workers=r.get(raw, "orarend_fetch_workers", int, defaults.orarend_fetch_workers, ""),
+        email=_parse_email(r, raw.get("email")),
+    )
+
+    try:
+        ZoneInfo(cfg.timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        problems.append(f"timezone: '{cfg.timezone}' not found (install tzdata: pip install tzdata)")
+    try:
+        codecs.lookup(cfg.fallback_encoding)
+    except LookupError:
+        problems.append(f"fallback_encoding: unknown encoding '{cfg.fallback_encoding}'")
+    if cfg.keep_snapshots < 1:
+        problems.append("keep_snapshots: must be >= 1")
+    if cfg.orarend_fetch_workers < 1:
+        problems.append("orarend_fetch_workers: must be >= 1")
+    needs_params = any(rg.week or rg.from_date for rg in cfg.orarend_ranges)
+    if needs_params and not (cfg.orarend_range_params.from_param and cfg.orarend_range_params.to_param):
+        problems.append("orarend_range_params: from and to are required for week or from/to ranges")
+
+    if problems:
+        raise ConfigError(path, problems)
+    return cfg
+
+
+def load_config(path: str = CONFIG_FILE) -> Config:
+    """Read and validate a config file; // and /* */ comments are allowed."""
+    try:
+        text = Path(path).read_text(encoding="utf-8-sig")
+    except OSError as e:
+        raise ConfigError(path, [f"cannot read file: {e}"]) from e
+    try:
+        raw = json.loads(strip_json_comments(text))
+    except json.JSONDecodeError as e:
+        raise ConfigError(path, [f"line {e.lineno} column {e.colno}: {e.msg}"]) from e
+    return parse_config(raw, path)
+
+
+# path -> (mtime_ns, Config); one parse per process unless hot reload sees a newer file
+_CACHE: Dict[str, Tuple[int, Config]] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def get_config(path: str = CONFIG_FILE, hot_reload: bool = False) -> Config:
+    """The process-wide Config for `path`.
+
+    The file is parsed on first use only. With `hot_reload` its mtime is
+    checked and a changed file is re-read; if the new file is invalid the
+    ConfigError is raised and the previous Config stays cached.
+    """
+    key = os.path.abspath(path)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None and not hot_reload:
+            return cached[1]
+        try:
+            mtime = os.stat(key).st_mtime_ns
+        except OSError as e:
+            if cached is not None:
+                return cached[1]
+            raise ConfigError(path, [f"cannot read file: {e}"]) from e
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        cfg = load_config(path)
+        _CACHE[key] = (mtime, cfg)
+        return cfg
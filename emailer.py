@@ -1,17 +1,23 @@
 from __future__ import annotations
 
 import base64
-from dataclasses import dataclass
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime
 from email.message import EmailMessage
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+from config import EmailConfig
+
 
 @dataclass
 class RunSummary:
@@ -32,6 +38,8 @@ class RunSummary:
     deleted_details: List[Dict[str, str]]
     unchanged_details: List[Dict[str, str]]
     errors: List[str]
+    # Hot-function table from main.py --profile; empty when not profiling
+    profile_top: str = ""
 
 
 def _format_errors(errors: List[str]) -> str:
@@ -40,24 +48,57 @@ def _format_errors(errors: List[str]) -> str:
     return "\n".join(f"- {err}" for err in errors)
 
 
-def _format_event_details(label: str, items: List[Dict[str, str]]) -> str:
+def summary_to_dict(summary: RunSummary) -> Dict:
+    data = asdict(summary)
+    data["started_at"] = summary.started_at.isoformat()
+    data["finished_at"] = summary.finished_at.isoformat()
+    return data
+
+
+def summary_from_dict(data: Dict) -> RunSummary:
+    # Keys from other versions of RunSummary are ignored; missing required ones raise.
+    known = {f.name for f in fields(RunSummary)}
+    data = {k: v for k, v in data.items() if k in known}
+    data["started_at"] = datetime.fromisoformat(data["started_at"])
+    data["finished_at"] = datetime.fromisoformat(data["finished_at"])
+    return RunSummary(**data)
+
+
+def _has_news(summary: RunSummary) -> bool:
+    return summary.status != "success" or bool(summary.created or summary.updated or summary.deleted)
+
+
+def _truncate(body: str, max_chars: int) -> str:
+    """Cut `body` to at most `max_chars` characters, the truncation note included."""
+    if len(body) <= max_chars:
+        return body
+    # Size the note for the largest possible count; the real count is never longer.
+    keep = max_chars - len(f"\n... (truncated, {len(body)} more characters)\n")
+    if keep <= 0:
+        return body[:max_chars]
+    return body[:keep] + f"\n... (truncated, {len(body) - keep} more characters)\n"
+
+
+def _format_event_details(label: str, items: List[Dict[str, str]], limit: int) -> str:
     if not items:
         return f"{label}: none\n"
     lines = [f"{label}:"]
-    for item in items:
+    for item in items[:limit]:
         summary = item.get("summary") or "(no title)"
         uid = item.get("uid") or "-"
         lines.append(f"- {summary} | uid={uid}")
+    if len(items) > limit:
+        lines.append(f"- ... and {len(items) - limit} more")
     lines.append("")
     return "\n".join(lines)
 
 
-def _build_body(summary: RunSummary) -> str:
+def _build_body(summary: RunSummary, max_details: int) -> str:
     details_block = (
-        _format_event_details("Created events", summary.created_details)
-        + _format_event_details("Updated events", summary.updated_details)
-        + _format_event_details("Deleted events", summary.deleted_details)
-        + _format_event_details("Unchanged events", summary.unchanged_details)
+        _format_event_details("Created events", summary.created_details, max_details)
+        + _format_event_details("Updated events", summary.updated_details, max_details)
+        + _format_event_details("Deleted events", summary.deleted_details, max_details)
+        + _format_event_details("Unchanged events", summary.unchanged_details, max_details)
     )
     return (
         "ELTE órarend sync run summary\n"
@@ -87,15 +128,42 @@ def _build_body(summary: RunSummary) -> str:
         f"{details_block}"
         "Errors:\n"
         f"{_format_errors(summary.errors)}\n"
+        + (f"\nProfile:\n{summary.profile_top}\n" if summary.profile_top else "")
     )
 
 
+def _build_digest_body(summaries: List[RunSummary], max_details: int, max_chars: int) -> str:
+    lines = [f"ELTE órarend sync digest ({len(summaries)} run(s))", ""]
+    for summary in summaries:
+        lines.append(
+            f"- {summary.started_at.isoformat(timespec='seconds')} | {summary.status} | "
+            f"created={summary.created} updated={summary.updated} deleted={summary.deleted} "
+            f"unchanged={summary.unchanged} | elapsed={summary.elapsed_s:.2f}s"
+        )
+    lines.append("")
+    # Only runs that changed something or failed get the full report.
+    for summary in summaries:
+        if _has_news(summary):
+            lines.append("=" * 60)
+            lines.append(_build_body(summary, max_details))
+    return _truncate("\n".join(lines), max_chars)
+
+
 GMAIL_SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
-GMAIL_TOKEN_FILE = "token_gmail.json"
-GMAIL_CREDENTIALS_FILE = "credentials.json"
+
+# (token_file, credentials_file) -> Gmail service, reused for the life of the process
+_GMAIL_SERVICES: Dict[Tuple[str, str], object] = {}
+# A lock file older than this is left over from a crashed run and is taken over.
+OUTBOX_LOCK_STALE_S = 600
+OUTBOX_LOCK_TIMEOUT_S = 120
 
 
 def _get_gmail_service(token_file: str, credentials_file: str):
+    key = (token_file, credentials_file)
+    service = _GMAIL_SERVICES.get(key)
+    if service is not None:
+        return service
+
     token_path = Path(token_file)
     creds = None
 
@@ -114,33 +182,141 @@ def _get_gmail_service(token_file: str, credentials_file: str):
             creds = flow.run_local_server(port=0)
         token_path.write_text(creds.to_json(), encoding="utf-8")
 
-    return build("gmail", "v1", credentials=creds)
-
-
-def send_run_email(summary: RunSummary, email_cfg: Dict) -> bool:
-    if not email_cfg or not email_cfg.get("enabled"):
-        return False
+    # The client refreshes the access token by itself, so caching the service is safe.
+    service = build("gmail", "v1", credentials=creds)
+    _GMAIL_SERVICES[key] = service
+    return service
 
-    to_addr = (email_cfg.get("to_addr") or "").strip()
-    from_addr = (email_cfg.get("from_addr") or "").strip()
-    subject_prefix = (email_cfg.get("subject_prefix") or "ELTE órarend sync").strip()
-    token_file = (email_cfg.get("token_file") or GMAIL_TOKEN_FILE).strip()
-    credentials_file = (email_cfg.get("credentials_file") or GMAIL_CREDENTIALS_FILE).strip()
 
-    if not (to_addr and from_addr):
+def _send(email_cfg: EmailConfig, subject_suffix: str, body: str) -> None:
+    if not (email_cfg.to_addr and email_cfg.from_addr):
         raise RuntimeError("Email config incomplete. Fill email.* in config.json.")
 
-    status_label = "SUCCESS" if summary.status == "success" else "FAILURE"
-    subject = f"{subject_prefix} | {status_label}"
-
     msg = EmailMessage()
-    msg["From"] = from_addr
-    msg["To"] = to_addr
-    msg["Subject"] = subject
-    msg.set_content(_build_body(summary))
+    msg["From"] = email_cfg.from_addr
+    msg["To"] = email_cfg.to_addr
+    msg["Subject"] = f"{email_cfg.subject_prefix} | {subject_suffix}"
+    msg.set_content(body)
 
-    service = _get_gmail_service(token_file, credentials_file)
+    service = _get_gmail_service(email_cfg.token_file, email_cfg.credentials_file)
     raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
     service.users().messages().send(userId="me", body={"raw": raw}).execute()
 
+
+def send_run_email(summary: RunSummary, email_cfg: EmailConfig) -> bool:
+    if not email_cfg.enabled:
+        return False
+
+    body = _build_body(summary, email_cfg.max_details_per_section)
+    status_label = "SUCCESS" if summary.status == "success" else "FAILURE"
+    _send(email_cfg, status_label, _truncate(body, email_cfg.max_body_chars))
+    return True
+
+
+@contextmanager
+def _outbox_lock(path: Path):
+    """Exclusive access to the outbox across threads and processes (O_EXCL lock file)."""
+    lock_path = path.with_name(path.name + ".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    deadline = time.monotonic() + OUTBOX_LOCK_TIMEOUT_S
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > OUTBOX_LOCK_STALE_S:
+                    lock_path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Outbox is locked by another run ({lock_path}); delete it if none is running.")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        yield
+    finally:
+        lock_path.unlink(missing_ok=True)
+
+
+def append_to_outbox(summary: RunSummary, email_cfg: EmailConfig) -> None:
+    path = Path(email_cfg.outbox_file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _outbox_lock(path), path.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(summary_to_dict(summary), ensure_ascii=False) + "\n")
+
+
+def _read_outbox(path: Path) -> List[RunSummary]:
+    """The queued summaries. Unreadable lines are moved to `<outbox>.bad`.
+
+    The caller holds the outbox lock. Without this a single truncated or
+    outdated line would fail every later flush and the queue would only grow.
+    """
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return []
+    good: List[str] = []
+    bad: List[str] = []
+    summaries: List[RunSummary] = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            summaries.append(summary_from_dict(json.loads(line)))
+            good.append(line)
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            print(f"Outbox entry skipped: {type(exc).__name__}: {exc}")
+            bad.append(line)
+    if bad:
+        with path.with_name(path.name + ".bad").open("a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in bad))
+        _rewrite_outbox(path, good)
+    return summaries
+
+
+def _rewrite_outbox(path: Path, lines: List[str]) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def flush_outbox(email_cfg: EmailConfig, force: bool = False, now: Optional[datetime] = None) -> bool:
+    """Send the queued run summaries as one digest if it is due.
+
+    Due means: `force`, any queued run failed or changed the calendar, or the
+    oldest queued run is at least `digest_window_minutes` old (0 = every run).
+    Sent entries are removed from the outbox. The outbox lock is held from
+    the read until the outbox is cleared, so other runs' appends wait and
+    none is lost or sent twice.
+    """
+    if not email_cfg.enabled:
+        return False
+    path = Path(email_cfg.outbox_file)
+
+    with _outbox_lock(path):
+        summaries = _read_outbox(path)
+        if not summaries:
+            return False
+
+        window_min = email_cfg.digest_window_minutes
+        age_min = ((now or datetime.now()) - summaries[0].finished_at).total_seconds() / 60
+        if not (force or any(_has_news(s) for s in summaries) or age_min >= window_min):
+            return False
+
+        max_details, max_chars = email_cfg.max_details_per_section, email_cfg.max_body_chars
+        if len(summaries) == 1:
+            summary = summaries[0]
+            subject = "SUCCESS" if summary.status == "success" else "FAILURE"
+            body = _truncate(_build_body(summary, max_details), max_chars)
+        else:
+            failed = sum(1 for s in summaries if s.status != "success")
+            changed = sum(s.created + s.updated + s.deleted for s in summaries)
+            subject = f"DIGEST | {len(summaries)} runs | {failed} failed | {changed} changes"
+            body = _build_digest_body(summaries, max_details, max_chars)
+        _send(email_cfg, subject, body)
+
+        path.unlink()
     return True
@@ -1,15 +1,45 @@
-import json
+import argparse
 import time
 import traceback
 from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
 
+import profiling
+from config import CONFIG_FILE, ConfigError, get_config
 from scraper import download_orarend
 from parser import parse_snapshot
 from sync_calendar import sync_events
-from emailer import RunSummary, send_run_email
+from emailer import RunSummary, append_to_outbox, flush_outbox
 
 
-def main() -> None:
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Download, parse and sync the ELTE GTK órarend.")
+    ap.add_argument(
+        "--profile",
+        choices=["sampling", "deterministic"],
+        help="Profile each pipeline stage and write the stacks next to the snapshot",
+    )
+    ap.add_argument("--profile-format", choices=["collapsed", "speedscope"], default="collapsed")
+    ap.add_argument("--profile-top", type=int, default=20, help="Rows in the hot-function table")
+    ap.add_argument(
+        "--profile-interval", type=float, default=0.005, help="Sampling interval in seconds (sampling mode)"
+    )
+    return ap.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = _parse_args(argv)
+
+    # Validate the whole config before any network work; report every bad field at once.
+    try:
+        cfg = get_config()
+    except ConfigError as exc:
+        raise SystemExit(str(exc)) from None
+    problems = cfg.problems_for_run()
+    if problems:
+        raise SystemExit(str(ConfigError(CONFIG_FILE, problems)))
+
     start_wall = datetime.now()
     start_perf = time.perf_counter()
     snapshot_path = ""
@@ -27,36 +57,30 @@ def main() -> None:
     errors = []
     status = "success"
 
-    calendar_id = ""
-    calendar_name = ""
-    email_cfg = {}
-    lecture_group_letter = "K"
-    try:
-        with open("config.json", "r", encoding="utf-8-sig") as f:
-            cfg = json.load(f)
-            calendar_id = (cfg.get("calendar_id") or "").strip()
-            calendar_name = (cfg.get("calendar_name") or "").strip()
-            email_cfg = cfg.get("email") or {}
-            lecture_group_letter = (cfg.get("lecture_group_letter") or "K").strip()
-    except OSError:
-        pass
-
-    email_enabled = bool(email_cfg.get("enabled"))
+    calendar_id = cfg.calendar_id
+    calendar_name = cfg.calendar_name
+    email_cfg = cfg.email
     print(
         "Email config | "
-        f"enabled={email_enabled} | "
-        f"from={email_cfg.get('from_addr', '') or '-'} | "
-        f"to={email_cfg.get('to_addr', '') or '-'} | "
-        f"credentials_file={email_cfg.get('credentials_file', '') or '-'} | "
-        f"token_file={email_cfg.get('token_file', '') or '-'}"
+        f"enabled={email_cfg.enabled} | "
+        f"from={email_cfg.from_addr or '-'} | "
+        f"to={email_cfg.to_addr or '-'} | "
+        f"credentials_file={email_cfg.credentials_file or '-'} | "
+        f"token_file={email_cfg.token_file or '-'}"
     )
 
+    profiler = profiling.create(args.profile, args.profile_interval) if args.profile else None
+    profiling.activate(profiler)
+
     try:
-        snapshot_path = str(download_orarend())
-        events = parse_snapshot(snapshot_path, lecture_group_letter=lecture_group_letter)
+        snapshot_path = str(download_orarend(cfg))
+        with profiling.stage("parse"):
+            events = parse_snapshot(
+                snapshot_path, tz=cfg.timezone, lecture_group_letter=cfg.lecture_group_letter or "K"
+            )
         if not events:
             raise RuntimeError("No events parsed from the Órarend table.")
-        metrics = sync_events(events)
+        metrics = sync_events(events, cfg)
     except Exception as exc:
         status = "failure"
         errors.append(f"{type(exc).__name__}: {exc}")
@@ -66,6 +90,15 @@ def main() -> None:
         elapsed_s = time.perf_counter() - start_perf
         finished_at = datetime.now()
 
+        # The calendars actually synced (resolved ids), not the top-level config fields
+        targets = metrics.get("calendars") or []
+        if len(targets) == 1:
+            calendar_id = targets[0]["calendar_id"]
+            calendar_name = targets[0]["calendar_name"]
+        elif targets:
+            calendar_id = ", ".join(t["calendar_id"] for t in targets)
+            calendar_name = ", ".join(t["calendar_name"] or "-" for t in targets)
+
         summary = RunSummary(
             status=status,
             started_at=start_wall,
@@ -84,17 +117,32 @@ def main() -> None:
             deleted_details=metrics.get("deleted_details", []),
             unchanged_details=metrics.get("unchanged_details", []),
             errors=errors,
+            # Rendered before sending, so the emailed table has no email stage yet.
+            profile_top=profiler.top_table(args.profile_top) if profiler is not None else "",
         )
 
-        send_on_failure = bool(email_cfg.get("send_on_failure"))
-        if email_enabled and (status == "success" or send_on_failure):
+        if email_cfg.enabled and (status == "success" or email_cfg.send_on_failure):
             try:
-                send_run_email(summary, email_cfg)
+                with profiling.stage("email"):
+                    append_to_outbox(summary, email_cfg)
+                    if not flush_outbox(email_cfg):
+                        print("Email queued: digest window not reached and nothing changed.")
             except Exception as email_exc:
                 print(f"Email send failed: {email_exc}")
-        elif not email_enabled:
+        elif not email_cfg.enabled:
             print("Email not sent: email.enabled is false or email config missing.")
 
+        for t in targets if len(targets) > 1 else []:
+            print(
+                "Calendar summary | "
+                f"calendar={t['calendar_name'] or t['calendar_id']} | "
+                f"routed={t['events']} | "
+                f"created={t['created']} | "
+                f"updated={t['updated']} | "
+                f"deleted={t['deleted']} | "
+                f"unchanged={t['unchanged']}"
+            )
+
         print(
             "Run summary | "
             f"raw_exported={len(events)} | "
@@ -108,6 +156,16 @@ def main() -> None:
             f"elapsed_s={elapsed_s:.2f}"
         )
 
+        if profiler is not None:
+            profiling.activate(None)
+            if snapshot_path:
+                stem = Path(snapshot_path).with_suffix("")
+            else:
+                stem = Path(cfg.debug_dir) / f"failed_{start_wall.strftime('%Y-%m-%d_%H%M%S')}"
+            profile_path = profiler.write(stem.with_name(stem.name + ".profile"), args.profile_format)
+            print(f"Profile written | {profile_path}")
+            print(profiler.top_table(args.profile_top))
+
 
 if __name__ == "__main__":
     main()
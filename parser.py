@@ -17,6 +17,11 @@ class OrarendEvent:
     end: datetime
     location: str
     description: str
+    # Raw columns kept for routing events to calendars (sync_calendar.route_events)
+    subject: str = ""
+    subject_code: str = ""
+    course_type: str = ""
+    group: str = ""
 
 
 def normalize_text(s: str) -> str:
@@ -46,15 +51,17 @@ def parse_course_type(cell_text: str) -> tuple[str, str, str]:
     return course_type, group, course_code
 
 
-def parse_table(html: str, tz: str, lecture_group_letter: str) -> List[OrarendEvent]:
-    soup = BeautifulSoup(html, "html.parser")
-    tables = soup.find_all("table")
-    target = None
-    for t in tables:
+def find_timetable(soup: BeautifulSoup):
+    for t in soup.find_all("table"):
         headers = [normalize_text(th.get_text(" ", strip=True)) for th in t.find_all("th")]
         if "Nap" in headers and "Idősáv" in headers:
-            target = t
-            break
+            return t
+    return None
+
+
+def parse_table(html: str, tz: str, lecture_group_letter: str) -> List[OrarendEvent]:
+    soup = BeautifulSoup(html, "html.parser")
+    target = find_timetable(soup)
 
     if target is None:
         return []
@@ -140,6 +147,10 @@ def parse_table(html: str, tz: str, lecture_group_letter: str) -> List[OrarendEv
                 end=end_dt,
                 location=location,
                 description=description,
+                subject=subject_name,
+                subject_code=subject_code,
+                course_type=course_type,
+                group=group,
             )
         )
 
@@ -0,0 +1,331 @@
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+STAGES = ["login", "download", "encoding", "parse", "calendar_list", "mutations", "email"]
+
+# Frames of the profiler itself (and of the `with stage(...)` plumbing) are left out of stacks.
+_SKIP_FILES = {Path(__file__).name, "contextlib.py", "threading.py"}
+
+_active: Optional["Profiler"] = None
+
+
+def _label(code) -> Optional[str]:
+    name = Path(code.co_filename).name
+    if name in _SKIP_FILES:
+        return None
+    qualname = getattr(code, "co_qualname", code.co_name)
+    return f"{qualname} ({name}:{code.co_firstlineno})"
+
+
+def _c_label(fn) -> str:
+    return f"{getattr(fn, '__qualname__', repr(fn))} (built-in)"
+
+
+def _frame_stack(frame) -> List[str]:
+    labels = []
+    while frame is not None:
+        label = _label(frame.f_code)
+        if label:
+            labels.append(label)
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class Profiler:
+    """Collects weighted stacks per pipeline stage. Weights are microseconds."""
+
+    mode = ""
+
+    def __init__(self):
+        self.stacks: Dict[str, Counter] = {}
+        self.wall_s: Dict[str, float] = {}
+        # Per thread: stack of [stage name, time it (re)started running]; guarded by _lock,
+        # since the sampler thread reads the other threads' stacks
+        self._thread_stages: Dict[int, List[list]] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def _add(self, stage_name: str, key: Tuple[str, ...], weight_us: float) -> None:
+        with self._lock:
+            counter = self.stacks.get(stage_name)
+            if counter is None:
+                counter = self.stacks[stage_name] = Counter()
+            counter[key] += weight_us
+
+    def _add_wall(self, stage_name: str, seconds: float) -> None:
+        # Caller holds self._lock
+        self.wall_s[stage_name] = self.wall_s.get(stage_name, 0.0) + seconds
+
+    def current_stage(self, tid: Optional[int] = None) -> Optional[str]:
+        with self._lock:
+            stages = self._thread_stages.get(threading.get_ident() if tid is None else tid)
+            return stages[-1][0] if stages else None
+
+    def active_stages(self) -> Dict[int, str]:
+        """Innermost stage of every thread that is inside one, as a consistent snapshot."""
+        with self._lock:
+            return {tid: stages[-1][0] for tid, stages in self._thread_stages.items() if stages}
+
+    def enter(self, stage_name: str) -> None:
+        # Nested stages pause the outer one, so wall times are exclusive.
+        now = time.perf_counter()
+        with self._lock:
+            stages = self._thread_stages.setdefault(threading.get_ident(), [])
+            if stages:
+                self._add_wall(stages[-1][0], now - stages[-1][1])
+            stages.append([stage_name, now])
+
+    def exit(self, stage_name: str) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            stages = self._thread_stages.get(threading.get_ident())
+            if not stages:
+                return
+            name, started = stages.pop()
+            self._add_wall(name, now - started)
+            if stages:
+                stages[-1][1] = now
+            else:
+                self._thread_stages.pop(threading.get_ident(), None)
+
+    def collapsed(self) -> str:
+        lines = []
+        for stage_name in self._stage_order():
+            for key, weight in self.stacks.get(stage_name, {}).items():
+                if weight >= 1:
+                    lines.append(";".join((stage_name,) + key) + f" {int(weight)}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict:
+        frames: List[Dict[str, str]] = []
+        index: Dict[str, int] = {}
+        profiles = []
+        for stage_name in self._stage_order():
+            samples = []
+            weights = []
+            for key, weight in self.stacks.get(stage_name, {}).items():
+                ids = []
+                for label in key:
+                    if label not in index:
+                        index[label] = len(frames)
+                        frames.append({"name": label})
+                    ids.append(index[label])
+                samples.append(ids)
+                weights.append(round(weight, 1))
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": f"{stage_name} ({self.mode})",
+                    "unit": "microseconds",
+                    "startValue": 0,
+                    "endValue": round(sum(weights), 1),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            )
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "elte_orarend_sync",
+            "exporter": "elte_orarend_sync profiling.py",
+        }
+
+    def write(self, path_stem: Path, fmt: str) -> Path:
+        path_stem.parent.mkdir(parents=True, exist_ok=True)
+        if fmt == "speedscope":
+            path = path_stem.with_name(path_stem.name + ".speedscope.json")
+            path.write_text(json.dumps(self.speedscope(), ensure_ascii=False), encoding="utf-8")
+        else:
+            path = path_stem.with_name(path_stem.name + ".collapsed.txt")
+            path.write_text(self.collapsed(), encoding="utf-8")
+        return path
+
+    def top_table(self, n: int = 20) -> str:
+        self_us: Counter = Counter()
+        total_us: Counter = Counter()
+        for counter in self.stacks.values():
+            for key, weight in counter.items():
+                if not key:
+                    continue
+                self_us[key[-1]] += weight
+                for label in set(key):
+                    total_us[label] += weight
+        grand = sum(self_us.values()) or 1.0
+
+        stages = " | ".join(f"{s}={self.wall_s[s]:.2f}s" for s in self._stage_order() if s in self.wall_s)
+        lines = [
+            f"Profile ({self.mode}) stages | {stages or '-'}",
+            f"{'self_ms':>10} {'total_ms':>10} {'self%':>6}  function",
+        ]
+        for label, weight in self_us.most_common(n):
+            lines.append(
+                f"{weight / 1000:>10.2f} {total_us[label] / 1000:>10.2f} {100 * weight / grand:>5.1f}%  {label}"
+            )
+        return "\n".join(lines)
+
+    def _stage_order(self) -> List[str]:
+        known = [s for s in STAGES if s in self.stacks or s in self.wall_s]
+        return known + sorted(s for s in self.stacks if s not in STAGES)
+
+
+class SamplingProfiler(Profiler):
+    """Samples the stacks of every thread that is inside a stage.
+
+    The sampler needs the GIL, so samples cluster where the profiled thread
+    releases it (network and file I/O). Good for I/O-bound stages; use the
+    deterministic mode for CPU-bound ones such as parse.
+    """
+
+    mode = "sampling"
+
+    def __init__(self, interval_s: float = 0.005):
+        super().__init__()
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval_s):
+            now = time.perf_counter()
+            # Weight each sample by the real elapsed time, not the nominal interval.
+            weight_us = (now - last) * 1e6
+            last = now
+            frames = sys._current_frames()
+            for tid, stage_name in self.active_stages().items():
+                frame = frames.get(tid)
+                if frame is not None:
+                    self._add(stage_name, tuple(_frame_stack(frame)), weight_us)
+
+
+class DeterministicProfiler(Profiler):
+    """Traces every call inside a stage with sys.setprofile (per thread, high overhead)."""
+
+    mode = "deterministic"
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    def enter(self, stage_name: str) -> None:
+        # The bookkeeping below must not be traced: it takes self._lock, and a
+        # traced call inside the lock would re-enter _trace -> _add and deadlock.
+        prev_profile = sys.getprofile()
+        sys.setprofile(None)
+        local = self._local
+        if self.current_stage() is not None:
+            # Already tracing this thread; attribute from here on to the inner stage.
+            self._charge()
+            super().enter(stage_name)
+            local.stage = stage_name
+            sys.setprofile(self._trace)
+            return
+        local.prev_profile = prev_profile
+        super().enter(stage_name)
+        local.stage = stage_name
+        # Seed with the live frames so returns from them pop the right entries.
+        frames = []
+        frame = sys._getframe(1)
+        while frame is not None:
+            frames.append(frame)
+            frame = frame.f_back
+        local.stack = []
+        key: Tuple[str, ...] = ()
+        for frame in reversed(frames):
+            label = _label(frame.f_code)
+            if label:
+                key = key + (label,)
+            local.stack.append((frame, key))
+        local.last = time.perf_counter()
+        sys.setprofile(self._trace)
+
+    def exit(self, stage_name: str) -> None:
+        sys.setprofile(None)
+        self._charge()
+        super().exit(stage_name)
+        outer = self.current_stage()
+        if outer is not None:
+            self._local.stage = outer
+            sys.setprofile(self._trace)
+            return
+        sys.setprofile(getattr(self._local, "prev_profile", None))
+
+    def _charge(self) -> None:
+        local = self._local
+        now = time.perf_counter()
+        if local.stack:
+            self._add(local.stage, local.stack[-1][1], (now - local.last) * 1e6)
+        local.last = now
+
+    def _trace(self, frame, event, arg) -> None:
+        self._charge()
+        stack = self._local.stack
+        parent = stack[-1][1] if stack else ()
+        if event == "call":
+            label = _label(frame.f_code)
+            stack.append((frame, parent + (label,) if label else parent))
+        elif event == "c_call":
+            stack.append((None, parent + (_c_label(arg),)))
+        elif event in ("c_return", "c_exception"):
+            if stack and stack[-1][0] is None:
+                stack.pop()
+        elif event == "return":
+            for i in range(len(stack) - 1, -1, -1):
+                if stack[i][0] is frame:
+                    del stack[i:]
+                    break
+        self._local.last = time.perf_counter()
+
+
+def create(mode: str, interval_s: float = 0.005) -> Profiler:
+    if mode == "sampling":
+        return SamplingProfiler(interval_s)
+    if mode == "deterministic":
+        return DeterministicProfiler()
+    raise RuntimeError(f"Unknown profile mode '{mode}'. Use 'sampling' or 'deterministic'.")
+
+
+def activate(profiler: Optional[Profiler]) -> None:
+    global _active
+    if _active is not None:
+        _active.stop()
+    _active = profiler
+    if profiler is not None:
+        profiler.start()
+
+
+@contextmanager
+def stage(name: str):
+    """Mark a pipeline stage; a no-op unless a profiler was activated."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit(name)
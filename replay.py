@@ -0,0 +1,306 @@
+import argparse
+import copy
+import json
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import CONFIG_FILE, Config, ConfigError, get_config
+from parser import parse_snapshot
+from sync_calendar import apply_sync
+
+OFFLINE_CALENDAR_ID = "offline"
+PAGE_SIZE = 250
+
+
+class _Request:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return self._fn()
+
+
+class OfflineEvents:
+    def __init__(self, store: Dict[str, Dict[str, Dict]], counter: List[int]):
+        self._store = store
+        self._counter = counter
+
+    def _calendar(self, calendar_id: str) -> Dict[str, Dict]:
+        return self._store.setdefault(calendar_id, {})
+
+    def list(self, calendarId: str, timeMin: str, pageToken: Optional[str] = None, **_) -> _Request:
+        def run():
+            time_min = datetime.fromisoformat(timeMin)
+            items = [
+                ev
+                for ev in self._calendar(calendarId).values()
+                if datetime.fromisoformat(ev["end"]["dateTime"]) > time_min
+            ]
+            items.sort(key=lambda ev: ev["start"]["dateTime"])
+            offset = int(pageToken or 0)
+            resp = {"items": items[offset:offset + PAGE_SIZE]}
+            if offset + PAGE_SIZE < len(items):
+                resp["nextPageToken"] = str(offset + PAGE_SIZE)
+            return resp
+
+        return _Request(run)
+
+    def insert(self, calendarId: str, body: Dict) -> _Request:
+        def run():
+            self._counter[0] += 1
+            ev = dict(body, id=f"ev{self._counter[0]}")
+            self._calendar(calendarId)[ev["id"]] = ev
+            return ev
+
+        return _Request(run)
+
+    def update(self, calendarId: str, eventId: str, body: Dict) -> _Request:
+        def run():
+            cal = self._calendar(calendarId)
+            if eventId not in cal:
+                raise RuntimeError(f"Offline calendar has no event '{eventId}'.")
+            cal[eventId] = dict(body, id=eventId)
+            return cal[eventId]
+
+        return _Request(run)
+
+    def delete(self, calendarId: str, eventId: str) -> _Request:
+        def run():
+            if self._calendar(calendarId).pop(eventId, None) is None:
+                raise RuntimeError(f"Offline calendar has no event '{eventId}'.")
+            return ""
+
+        return _Request(run)
+
+
+class OfflineCalendarService:
+    """In-memory stand-in for the parts of the Calendar API used by apply_sync."""
+
+    def __init__(self, store: Optional[Dict[str, Dict[str, Dict]]] = None):
+        self.store: Dict[str, Dict[str, Dict]] = store if store is not None else {}
+        ids = [ev_id for cal in self.store.values() for ev_id in cal]
+        counter = max((int(i[2:]) for i in ids if i.startswith("ev") and i[2:].isdigit()), default=0)
+        self._events = OfflineEvents(self.store, [counter])
+
+    def events(self) -> OfflineEvents:
+        return self._events
+
+    @classmethod
+    def load(cls, path: Path) -> "OfflineCalendarService":
+        if not path.exists():
+            return cls()
+        return cls(json.loads(path.read_text(encoding="utf-8")))
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.store, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+@dataclass
+class ReplayStep:
+    snapshot: str
+    run_at: str
+    events_parsed: int
+    created: int
+    updated: int
+    deleted: int
+    unchanged: int
+    parse_ms: float
+    sync_ms: float
+    peak_kib: float
+    # "failure" when nothing was parsed: main.py aborts such a run before touching the calendar
+    status: str = "success"
+
+
+def list_snapshots(snapshots_dir: Path) -> List[Path]:
+    # Snapshot names are YYYY-MM-DD, so name order is run order.
+    return sorted(snapshots_dir.glob("*.html"), key=lambda p: p.name)
+
+
+def snapshot_run_time(path: Path, zone: ZoneInfo, run_time: str) -> datetime:
+    """The moment the scheduled run that produced the snapshot would have happened."""
+    hour, minute = (int(x) for x in run_time.split(":", 1))
+    try:
+        day = datetime.strptime(path.stem, "%Y-%m-%d")
+    except ValueError:
+        return datetime.fromtimestamp(path.stat().st_mtime, tz=zone)
+    return day.replace(hour=hour, minute=minute, tzinfo=zone)
+
+
+def replay(
+    snapshots: List[Path],
+    service: OfflineCalendarService,
+    tz: str = "Europe/Budapest",
+    lecture_group_letter: str = "K",
+    run_time: str = "01:00",
+    measure_memory: bool = True,
+) -> List[ReplayStep]:
+    """Replay the snapshots in order, mutating `service` like scheduled runs would.
+
+    A snapshot that parses to no events is recorded as a failed step with no
+    mutations, like main.py, which aborts before syncing.
+
+    Timings come from a pass without tracemalloc. With `measure_memory` each
+    step is run a second time under tracemalloc, against a throwaway copy of
+    the calendar state from before the step, to get the peak.
+    """
+    try:
+        zone = ZoneInfo(tz)
+    except ZoneInfoNotFoundError as e:
+        raise RuntimeError(
+            f"Time zone '{tz}' not found. Install tzdata: pip install tzdata"
+        ) from e
+
+    steps: List[ReplayStep] = []
+    for path in snapshots:
+        now_dt = snapshot_run_time(path, zone, run_time)
+
+        before = copy.deepcopy(service.store) if measure_memory else None
+
+        t0 = time.perf_counter()
+        events = parse_snapshot(str(path), tz=tz, lecture_group_letter=lecture_group_letter)
+        t1 = time.perf_counter()
+        if events:
+            metrics = apply_sync(service, OFFLINE_CALENDAR_ID, events, tz, now_dt)
+        else:
+            metrics = {"created": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        t2 = time.perf_counter()
+
+        peak = 0
+        if before is not None:
+            scratch = OfflineCalendarService(before)
+            tracemalloc.start()
+            scratch_events = parse_snapshot(str(path), tz=tz, lecture_group_letter=lecture_group_letter)
+            if scratch_events:
+                apply_sync(scratch, OFFLINE_CALENDAR_ID, scratch_events, tz, now_dt)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        steps.append(
+            ReplayStep(
+                snapshot=path.name,
+                run_at=now_dt.isoformat(),
+                events_parsed=len(events),
+                created=metrics["created"],
+                updated=metrics["updated"],
+                deleted=metrics["deleted"],
+                unchanged=metrics["unchanged"],
+                parse_ms=(t1 - t0) * 1000,
+                sync_ms=(t2 - t1) * 1000,
+                peak_kib=peak / 1024,
+                status="success" if events else "failure",
+            )
+        )
+    return steps
+
+
+def _mutation_key(step: Dict) -> tuple:
+    return tuple(step[k] for k in ("events_parsed", "created", "updated", "deleted", "unchanged"))
+
+
+def check_baseline(steps: List[ReplayStep], baseline_path: Path) -> List[str]:
+    """Compare parse and mutation counts (not timings) with a saved replay."""
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    expected = {s["snapshot"]: s for s in baseline.get("steps", [])}
+    problems = []
+    for step in steps:
+        want = expected.pop(step.snapshot, None)
+        if want is None:
+            problems.append(f"{step.snapshot}: not in baseline")
+            continue
+        got = asdict(step)
+        if _mutation_key(got) != _mutation_key(want):
+            problems.append(
+                f"{step.snapshot}: expected parsed/created/updated/deleted/unchanged="
+                f"{_mutation_key(want)}, got {_mutation_key(got)}"
+            )
+    for name in expected:
+        problems.append(f"{name}: missing from replay")
+    return problems
+
+
+def print_report(steps: List[ReplayStep]) -> None:
+    print(
+        f"{'snapshot':<20} {'parsed':>6} {'created':>7} {'updated':>7} {'deleted':>7} "
+        f"{'unchanged':>9} {'parse_ms':>9} {'sync_ms':>8} {'peak_kib':>9}"
+    )
+    for s in steps:
+        print(
+            f"{s.snapshot:<20} {s.events_parsed:>6} {s.created:>7} {s.updated:>7} {s.deleted:>7} "
+            f"{s.unchanged:>9} {s.parse_ms:>9.2f} {s.sync_ms:>8.2f} {s.peak_kib:>9.1f}"
+            + ("  FAILED: no events parsed, sync skipped" if s.status != "success" else "")
+        )
+    total_ms = sum(s.parse_ms + s.sync_ms for s in steps)
+    peak = max((s.peak_kib for s in steps), default=0.0)
+    failed = sum(1 for s in steps if s.status != "success")
+    print(f"Replay summary | steps={len(steps)} | failed={failed} | total_ms={total_ms:.2f} | peak_kib={peak:.1f}")
+
+
+def main() -> None:
+    # Replay runs offline, so config.json is optional here; only its defaults are used.
+    cfg = Config()
+    if Path(CONFIG_FILE).exists():
+        try:
+            cfg = get_config()
+        except ConfigError as exc:
+            raise SystemExit(str(exc)) from None
+
+    ap = argparse.ArgumentParser(
+        description="Replay archived órarend snapshots through parse + sync against an offline calendar."
+    )
+    ap.add_argument("snapshots", nargs="*", help="Snapshot files in run order (default: all in snapshots_dir)")
+    ap.add_argument("--snapshots-dir", default=cfg.snapshots_dir)
+    ap.add_argument("--timezone", default=cfg.timezone)
+    ap.add_argument("--lecture-group-letter", default=cfg.lecture_group_letter or "K")
+    ap.add_argument("--run-time", default="01:00", help="Time of day of the scheduled run (HH:MM)")
+    ap.add_argument("--state", help="Offline calendar JSON to start from; updated after the replay")
+    ap.add_argument("--save-baseline", help="Write the replay result to this JSON file")
+    ap.add_argument("--check", help="Fail if parse/mutation counts differ from this baseline JSON")
+    ap.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass (peak_kib is 0)")
+    args = ap.parse_args()
+
+    if args.save_baseline and args.check and Path(args.save_baseline).resolve() == Path(args.check).resolve():
+        raise SystemExit("--save-baseline and --check must not point to the same file.")
+
+    if args.snapshots:
+        snapshots = [Path(p) for p in args.snapshots]
+    else:
+        snapshots = list_snapshots(Path(args.snapshots_dir))
+    if not snapshots:
+        raise SystemExit(f"No snapshots found in {args.snapshots_dir}.")
+
+    state_path = Path(args.state) if args.state else None
+    service = OfflineCalendarService.load(state_path) if state_path else OfflineCalendarService()
+
+    steps = replay(
+        snapshots,
+        service,
+        tz=args.timezone,
+        lecture_group_letter=args.lecture_group_letter,
+        run_time=args.run_time,
+        measure_memory=not args.no_memory,
+    )
+    print_report(steps)
+
+    problems = check_baseline(steps, Path(args.check)) if args.check else []
+    for p in problems:
+        print(f"Replay mismatch | {p}")
+
+    if state_path:
+        service.save(state_path)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(
+            json.dumps({"steps": [asdict(s) for s in steps]}, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,32 @@
-﻿import json
-from datetime import datetime
+﻿import codecs
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import chain
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, Optional
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
+import profiling
+from config import Config, OrarendRange, RangeParams, get_config
+from parser import find_timetable, normalize_text
 
-def load_config(path: str = "config.json") -> dict:
-    with open(path, "r", encoding="utf-8-sig") as f:
-        return json.load(f)
+
+CHUNK_SIZE = 64 * 1024
+# The meta charset has to appear in the first 1024 bytes per the HTML spec; allow some slack.
+SNIFF_BYTES = 4096
+DENIED_MARKER = b"Nincs jogosults"
+try:
+    import brotli  # noqa: F401  (lets urllib3 decode "br" responses)
+
+    ACCEPT_ENCODING = "gzip, deflate, br"
+except ImportError:
+    ACCEPT_ENCODING = "gzip, deflate"
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
 
 
 def cookie_string_to_dict(cookie: str) -> Dict[str, str]:
@@ -42,12 +59,7 @@ def find_orarend_url(html: str, base_url: str) -> Optional[str]:
     return None
 
 
-def save_snapshot(html: str, snapshots_dir: Path, keep: int) -> Path:
-    snapshots_dir.mkdir(parents=True, exist_ok=True)
-    stamp = datetime.now().strftime("%Y-%m-%d")
-    path = snapshots_dir / f"{stamp}.html"
-    path.write_text(html, encoding="utf-8")
-
+def _prune_snapshots(snapshots_dir: Path, keep: int) -> None:
     # Keep only last N snapshots (by mtime)
     files = sorted(snapshots_dir.glob("*.html"), key=lambda p: p.stat().st_mtime, reverse=True)
     for old in files[keep:]:
@@ -55,9 +67,229 @@ def save_snapshot(html: str, snapshots_dir: Path, keep: int) -> Path:
             old.unlink()
         except OSError:
             pass
+
+
+def _snapshot_path(snapshots_dir: Path) -> Path:
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y-%m-%d")
+    return snapshots_dir / f"{stamp}.html"
+
+
+def save_snapshot(html: str, snapshots_dir: Path, keep: int) -> Path:
+    path = _snapshot_path(snapshots_dir)
+    path.write_text(html, encoding="utf-8")
+    _prune_snapshots(snapshots_dir, keep)
     return path
 
 
+def _lookup_encoding(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name.strip().strip("\"'")).name
+    except LookupError:
+        return None
+
+
+def _header_charset(resp: requests.Response) -> Optional[str]:
+    content_type = resp.headers.get("Content-Type", "")
+    for param in content_type.split(";")[1:]:
+        key, _, value = param.partition("=")
+        if key.strip().lower() == "charset":
+            return _lookup_encoding(value)
+    return None
+
+
+def _meta_charset(head: bytes) -> Optional[str]:
+    m = _META_CHARSET_RE.search(head[:SNIFF_BYTES])
+    return _lookup_encoding(m.group(1).decode("ascii")) if m else None
+
+
+def _transcode_file(path: Path, encoding: str) -> None:
+    tmp = path.with_name(path.name + ".utf8")
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    try:
+        with path.open("rb") as src, tmp.open("wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                dst.write(decoder.decode(chunk).encode("utf-8"))
+            dst.write(decoder.decode(b"", final=True).encode("utf-8"))
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def stream_to_file(resp: requests.Response, path: Path, fallback_encoding: str = "cp1250") -> bool:
+    """Write a streamed response to `path` as UTF-8 without holding the page in memory.
+
+    Charset: Content-Type header, then <meta charset>, then UTF-8 if the body
+    validates, else `fallback_encoding`. UTF-8 bodies are written byte for
+    byte. Returns True if the "no access" marker was seen.
+    """
+    chunks: Iterator[bytes] = resp.iter_content(CHUNK_SIZE)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= SNIFF_BYTES:
+            break
+
+    with profiling.stage("encoding"):
+        encoding = _header_charset(resp) or _meta_charset(head)
+
+    denied = False
+    tail = b""
+    valid_utf8 = True
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as f:
+        if encoding in (None, "utf-8"):
+            validator = codecs.getincrementaldecoder("utf-8")()
+            for chunk in chain([head], chunks):
+                window = tail + chunk
+                denied = denied or DENIED_MARKER in window
+                tail = window[-(len(DENIED_MARKER) - 1):]
+                if encoding is None and valid_utf8:
+                    with profiling.stage("encoding"):
+                        try:
+                            validator.decode(chunk)
+                        except UnicodeDecodeError:
+                            valid_utf8 = False
+                f.write(chunk)
+            if encoding is None and valid_utf8:
+                try:
+                    validator.decode(b"", final=True)
+                except UnicodeDecodeError:
+                    valid_utf8 = False
+        else:
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            for chunk in chain([head], chunks):
+                window = tail + chunk
+                denied = denied or DENIED_MARKER in window
+                tail = window[-(len(DENIED_MARKER) - 1):]
+                with profiling.stage("encoding"):
+                    data = decoder.decode(chunk).encode("utf-8")
+                f.write(data)
+            f.write(decoder.decode(b"", final=True).encode("utf-8"))
+
+    if encoding is None and not valid_utf8:
+        with profiling.stage("encoding"):
+            _transcode_file(path, fallback_encoding)
+    return denied
+
+
+def range_params(entry: OrarendRange, param_cfg: RangeParams) -> Dict[str, str]:
+    """Query parameters for one `orarend_ranges` entry.
+
+    `params` entries are sent as is; week and from/to entries are mapped
+    through `orarend_range_params` (config.py checks that it is set).
+    """
+    if entry.params:
+        return dict(entry.params)
+
+    if entry.week:
+        year, week = entry.week.split("-W", 1)
+        start = date.fromisocalendar(int(year), int(week), 1)
+        end = start + timedelta(days=6)
+    else:
+        start = date.fromisoformat(entry.from_date)
+        end = date.fromisoformat(entry.to_date or entry.from_date)
+
+    fmt = param_cfg.date_format
+    return {param_cfg.from_param: start.strftime(fmt), param_cfg.to_param: end.strftime(fmt)}
+
+
+def _row_key(row) -> tuple:
+    return tuple(normalize_text(td.get_text(" ", strip=True)) for td in row.find_all("td"))
+
+
+def merge_timetables(pages: List[str]) -> str:
+    """Merge the timetable rows of several pages into the first page that has a timetable.
+
+    Ranges may overlap (e.g. a week inside the exam period), so the same row
+    can show up on more than one page. A range may also have no table yet
+    (an empty week, an unpublished exam period); such pages are skipped.
+    Returns pages[0] unchanged only if no page has a timetable.
+    """
+    base = target = None
+    for first, html in enumerate(pages):
+        base = BeautifulSoup(html, "html.parser")
+        target = find_timetable(base)
+        if target is not None:
+            break
+    if target is None:
+        return pages[0]
+
+    seen = set()
+    for row in target.find_all("tr"):
+        if len(row.find_all("td")) < 6:
+            continue
+        key = _row_key(row)
+        if key in seen:
+            row.decompose()
+        else:
+            seen.add(key)
+
+    # Append into the table's own row container (tbody if present)
+    container = target.find("tbody") or target
+    for html in pages[first + 1:]:
+        other = find_timetable(BeautifulSoup(html, "html.parser"))
+        if other is None:
+            continue
+        for row in other.find_all("tr"):
+            if len(row.find_all("td")) < 6:
+                continue
+            key = _row_key(row)
+            if key not in seen:
+                seen.add(key)
+                container.append(row.extract())
+    return str(base)
+
+
+def _fetch_to_file(
+    session: requests.Session, url: str, params: Optional[Dict[str, str]], path: Path, fallback_encoding: str
+) -> bool:
+    with session.get(url, params=params, timeout=30, stream=True) as resp:
+        resp.raise_for_status()
+        return stream_to_file(resp, path, fallback_encoding)
+
+
+def _denied(cfg: Config, part: Path) -> RuntimeError:
+    debug_dir = Path(cfg.debug_dir)
+    debug_dir.mkdir(parents=True, exist_ok=True)
+    os.replace(part, debug_dir / "orarend_denied.html")
+    return RuntimeError(
+        "Login failed or no access to Órarend page. "
+        "Saved debug HTML to data/debug/orarend_denied.html"
+    )
+
+
+def _download_ranges(
+    session: requests.Session, cfg: Config, orarend_url: str, path: Path, fallback_encoding: str
+) -> None:
+    params = [range_params(entry, cfg.orarend_range_params) for entry in cfg.orarend_ranges]
+    workers = max(1, min(len(params), cfg.orarend_fetch_workers))
+
+    # One pool large enough for all workers, so they reuse the logged-in connections.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    parts = [path.with_name(f"{path.name}.range{i}.part") for i in range(len(params))]
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_fetch_to_file, session, orarend_url, p, part, fallback_encoding)
+                for p, part in zip(params, parts)
+            ]
+            denied = [f.result() for f in futures]
+        for part, was_denied in zip(parts, denied):
+            if was_denied:
+                raise _denied(cfg, part)
+        pages = [part.read_text(encoding="utf-8") for part in parts]
+        path.write_text(merge_timetables(pages), encoding="utf-8")
+    finally:
+        for part in parts:
+            part.unlink(missing_ok=True)
+
+
 def _extract_form(soup: BeautifulSoup) -> Optional[BeautifulSoup]:
     return soup.find("form")
 
@@ -112,18 +344,18 @@ def _follow_saml_posts(
     return current
 
 
-def login(session: requests.Session, cfg: dict, start_url: Optional[str] = None) -> None:
-    login_url = cfg.get("login_url", "").strip()
-    creds = cfg.get("credentials", {})
-    username = creds.get("username", "").strip()
-    password = creds.get("password", "").strip()
+def login(session: requests.Session, cfg: Config, start_url: Optional[str] = None) -> None:
+    login_url = cfg.login_url
+    creds = cfg.credentials
+    username = creds.username
+    password = creds.password
 
     if not login_url and not start_url:
         raise RuntimeError("Missing login_url in config.json.")
     if not username or not password:
         raise RuntimeError("Missing credentials.username or credentials.password in config.json.")
 
-    debug_dir = Path(cfg.get("debug_dir", "data/debug"))
+    debug_dir = Path(cfg.debug_dir)
 
     # Load login page (either explicit login_url or start_url which should redirect to login)
     first_url = login_url or start_url
@@ -139,13 +371,10 @@ def login(session: requests.Session, cfg: dict, start_url: Optional[str] = None)
 
     payload = _build_form_payload(form)
 
-    user_field = creds.get("username_field", "username")
-    pass_field = creds.get("password_field", "password")
-    payload[user_field] = username
-    payload[pass_field] = password
+    payload[creds.username_field] = username
+    payload[creds.password_field] = password
 
-    extra_fields = creds.get("extra_fields", {}) or {}
-    for k, v in extra_fields.items():
+    for k, v in creds.extra_fields.items():
         payload[k] = v
 
     r = _submit_form(session, form, resp.url, payload)
@@ -154,57 +383,63 @@ def login(session: requests.Session, cfg: dict, start_url: Optional[str] = None)
     # Follow any SAML auto-post forms
     _follow_saml_posts(session, r, debug_dir=debug_dir)
 
-def download_orarend() -> Path:
-    cfg = load_config()
+def download_orarend(cfg: Optional[Config] = None) -> Path:
+    cfg = cfg or get_config()
 
     s = requests.Session()
     s.headers.update({
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120 Safari/537.36",
         "Accept-Language": "hu-HU,hu;q=0.9,en-US;q=0.8,en;q=0.7",
+        # Only advertise br when it can be decoded
+        "Accept-Encoding": ACCEPT_ENCODING,
     })
 
-    cookie = cfg.get("cookie", "").strip()
-    if cookie:
-        s.cookies.update(cookie_string_to_dict(cookie))
+    if cfg.cookie:
+        s.cookies.update(cookie_string_to_dict(cfg.cookie))
 
     # Always login at each run (start from site=0 to trigger IdP redirect)
-    start_url = cfg.get("login_start_url", "").strip() or None
-    if not start_url:
-        start_url = cfg.get("orarend_url", "").strip() or None
-    login(s, cfg, start_url=start_url)
-
-    base_url = cfg.get("base_url", "https://inform.gtk.elte.hu/index.php?site=100")
-    orarend_url = cfg.get("orarend_url", "").strip() or None
-
-    # Hit base URL after login (establish session on inform.gtk.elte.hu)
-    base_resp = s.get(base_url, timeout=30)
-    base_resp.raise_for_status()
-
-    if not orarend_url:
-        orarend_url = find_orarend_url(base_resp.text, base_url)
-
-    if not orarend_url:
-        raise RuntimeError("Could not determine Órarend URL. Set 'orarend_url' in config.json.")
-
-    resp = s.get(orarend_url, timeout=30)
-    resp.raise_for_status()
-
-    # Some pages are served with legacy encodings; try to recover if needed
-    if "charset" not in resp.headers.get("Content-Type", ""):
-        resp.encoding = resp.apparent_encoding or "utf-8"
-
-    html = resp.text
-    if "Nincs jogosults" in html or "Nincs jogosultsága" in html:
-        debug_dir = Path(cfg.get("debug_dir", "data/debug"))
-        debug_dir.mkdir(parents=True, exist_ok=True)
-        (debug_dir / "orarend_denied.html").write_text(html, encoding="utf-8")
-        raise RuntimeError(
-            "Login failed or no access to Órarend page. "
-            "Saved debug HTML to data/debug/orarend_denied.html"
-        )
-    snapshots_dir = Path(cfg.get("snapshots_dir", "data/snapshots"))
-    keep = int(cfg.get("keep_snapshots", 7))
-    return save_snapshot(html, snapshots_dir, keep)
+    start_url = cfg.login_start_url or cfg.orarend_url or None
+    with profiling.stage("login"):
+        login(s, cfg, start_url=start_url)
+
+    base_url = cfg.base_url
+    orarend_url = cfg.orarend_url or None
+
+    with profiling.stage("download"):
+        # Hit base URL after login (establish session on inform.gtk.elte.hu)
+        base_resp = s.get(base_url, timeout=30)
+        base_resp.raise_for_status()
+
+        if not orarend_url:
+            orarend_url = find_orarend_url(base_resp.text, base_url)
+
+        if not orarend_url:
+            raise RuntimeError("Could not determine Órarend URL. Set 'orarend_url' in config.json.")
+
+    snapshots_dir = Path(cfg.snapshots_dir)
+    keep = cfg.keep_snapshots
+    fallback_encoding = cfg.fallback_encoding
+    path = _snapshot_path(snapshots_dir)
+    part = path.with_name(path.name + ".part")
+
+    if cfg.orarend_ranges:
+        with profiling.stage("download"):
+            _download_ranges(s, cfg, orarend_url, path, fallback_encoding)
+        _prune_snapshots(snapshots_dir, keep)
+        return path
+
+    try:
+        with profiling.stage("download"):
+            denied = _fetch_to_file(s, orarend_url, None, part, fallback_encoding)
+
+        if denied:
+            raise _denied(cfg, part)
+        os.replace(part, path)
+    finally:
+        # Only left over if streaming failed half way
+        part.unlink(missing_ok=True)
+    _prune_snapshots(snapshots_dir, keep)
+    return path
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
-﻿import json
+﻿import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Sequence
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from google.auth.transport.requests import Request
@@ -9,19 +10,20 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
+import profiling
+from config import CalendarTarget, Config, MatchRule, get_config
 from parser import OrarendEvent
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 CREDENTIALS_FILE = "credentials.json"
 TOKEN_FILE = "token.json"
 
+# calendarList summary -> id, filled from a single listing per process
+_CALENDAR_IDS: Dict[str, str] = {}
+_CALENDAR_IDS_LOCK = threading.Lock()
 
-def load_config(path: str = "config.json") -> dict:
-    with open(path, "r", encoding="utf-8-sig") as f:
-        return json.load(f)
 
-
-def get_calendar_service():
+def get_credentials() -> Credentials:
     creds = None
     token_path = Path(TOKEN_FILE)
 
@@ -41,7 +43,63 @@ def get_calendar_service():
 
         token_path.write_text(creds.to_json(), encoding="utf-8")
 
-    return build("calendar", "v3", credentials=creds)
+    return creds
+
+
+def get_calendar_service(creds: Optional[Credentials] = None):
+    # The discovery client is not thread-safe, so concurrent syncs each build
+    # their own service from one shared set of credentials.
+    return build("calendar", "v3", credentials=creds or get_credentials())
+
+
+def resolve_calendar_id(service, calendar_name: str) -> str:
+    with _CALENDAR_IDS_LOCK:
+        if calendar_name not in _CALENDAR_IDS:
+            page_token = None
+            while True:
+                resp = service.calendarList().list(pageToken=page_token).execute()
+                for c in resp.get("items", []):
+                    _CALENDAR_IDS.setdefault(c.get("summary", ""), c["id"])
+                page_token = resp.get("nextPageToken")
+                if not page_token:
+                    break
+        calendar_id = _CALENDAR_IDS.get(calendar_name)
+    if not calendar_id:
+        raise RuntimeError(f"Calendar named '{calendar_name}' not found.")
+    return calendar_id
+
+
+def _matches(e: OrarendEvent, rule: MatchRule) -> bool:
+    course_types = [t.lower() for t in rule.course_types]
+    groups = [g.lower() for g in rule.groups]
+    subjects = [x.lower() for x in rule.subjects]
+
+    course_type = e.course_type.lower()
+    # Prefix match, so "előadás" also covers "Előadás (online)" etc.
+    if course_types and not any(course_type.startswith(t) for t in course_types):
+        return False
+    if groups and e.group.lower() not in groups:
+        return False
+    if subjects and e.subject.lower() not in subjects and e.subject_code.lower() not in subjects:
+        return False
+    return True
+
+
+def route_events(
+    events: List[OrarendEvent], targets: Sequence[CalendarTarget]
+) -> List[List[OrarendEvent]]:
+    """Split events between targets; each event goes to the first target whose rule matches.
+
+    A target without a `match` rule matches everything, so it works as a catch-all
+    when listed last. Events matching no target are not synced anywhere.
+    """
+    routed: List[List[OrarendEvent]] = [[] for _ in targets]
+    for e in events:
+        for i, target in enumerate(targets):
+            if _matches(e, target.match):
+                routed[i].append(e)
+                break
+    return routed
 
 
 def event_to_gcal(e: OrarendEvent, tz: str) -> Dict:
@@ -81,24 +139,34 @@ def fetch_future_events(service, calendar_id: str, time_min: str) -> List[Dict]:
     return events
 
 
-def sync_events(events: List[OrarendEvent]) -> Dict[str, int]:
-    cfg = load_config()
-    tz = cfg.get("timezone", "Europe/Budapest")
-    calendar_id = cfg.get("calendar_id", "").strip() or None
-    calendar_name = cfg.get("calendar_name", "").strip() or None
+def _sync_target(
+    creds: Credentials, calendar_id: str, events: List[OrarendEvent], tz: str, now_dt: datetime
+) -> Dict[str, int]:
+    return apply_sync(get_calendar_service(creds), calendar_id, events, tz, now_dt)
+
 
-    if not calendar_id and not calendar_name:
+def sync_events(events: List[OrarendEvent], cfg: Optional[Config] = None) -> Dict:
+    cfg = cfg or get_config()
+    tz = cfg.timezone
+
+    # Either a list of routed target calendars or the single calendar_id/calendar_name;
+    # config.py has already validated both.
+    routing = bool(cfg.calendars)
+    targets = cfg.sync_targets()
+    if not (targets[0].calendar_id or targets[0].calendar_name):
         raise RuntimeError("Set calendar_id or calendar_name in config.json.")
 
-    service = get_calendar_service()
+    creds = get_credentials()
+    service = get_calendar_service(creds)
 
     # Resolve calendar_id by name if provided
-    if not calendar_id and calendar_name:
-        clist = service.calendarList().list().execute().get("items", [])
-        match = next((c for c in clist if c.get("summary") == calendar_name), None)
-        if not match:
-            raise RuntimeError(f"Calendar named '{calendar_name}' not found.")
-        calendar_id = match["id"]
+    calendar_ids = []
+    with profiling.stage("calendar_list"):
+        for target in targets:
+            calendar_id = target.calendar_id
+            if not calendar_id:
+                calendar_id = resolve_calendar_id(service, target.calendar_name)
+            calendar_ids.append(calendar_id)
 
     try:
         zone = ZoneInfo(tz)
@@ -107,18 +175,78 @@ def sync_events(events: List[OrarendEvent]) -> Dict[str, int]:
             f"Time zone '{tz}' not found. Install tzdata: pip install tzdata"
         ) from e
     now_dt = datetime.now(tz=zone)
-    now = now_dt.isoformat()
 
-    existing = fetch_future_events(service, calendar_id, now)
-    existing_by_uid: Dict[str, Dict] = {}
-    for ev in existing:
-        uid = (
-            ev.get("extendedProperties", {})
-            .get("private", {})
-            .get("elte_orarend_uid")
+    if not routing:
+        metrics = apply_sync(service, calendar_ids[0], events, tz, now_dt)
+        metrics["calendars"] = [
+            dict(
+                metrics,
+                calendar_id=calendar_ids[0],
+                calendar_name=targets[0].calendar_name,
+                events=len(events),
+            )
+        ]
+        return metrics
+
+    routed = route_events(events, targets)
+    unrouted = len(events) - sum(len(r) for r in routed)
+    if unrouted:
+        print(f"Routing | {unrouted} event(s) matched no calendar and were skipped.")
+
+    # Several rules may point at one calendar. apply_sync deletes every tagged event
+    # it was not given, so each calendar must be synced once with all of its events.
+    by_calendar: Dict[str, List[OrarendEvent]] = {}
+    names: Dict[str, List[str]] = {}
+    for calendar_id, target, target_events in zip(calendar_ids, targets, routed):
+        by_calendar.setdefault(calendar_id, []).extend(target_events)
+        name = target.calendar_name
+        names.setdefault(calendar_id, [])
+        if name and name not in names[calendar_id]:
+            names[calendar_id].append(name)
+
+    with ThreadPoolExecutor(max_workers=len(by_calendar)) as pool:
+        futures = {
+            calendar_id: pool.submit(_sync_target, creds, calendar_id, cal_events, tz, now_dt)
+            for calendar_id, cal_events in by_calendar.items()
+        }
+        results = {calendar_id: f.result() for calendar_id, f in futures.items()}
+
+    totals: Dict = {
+        key: sum(r[key] for r in results.values()) for key in ("created", "updated", "deleted", "unchanged")
+    }
+    totals["calendars"] = [
+        dict(
+            results[calendar_id],
+            calendar_id=calendar_id,
+            calendar_name=", ".join(names[calendar_id]),
+            events=len(cal_events),
         )
-        if uid:
-            existing_by_uid[uid] = ev
+        for calendar_id, cal_events in by_calendar.items()
+    ]
+    return totals
+
+
+def apply_sync(
+    service, calendar_id: str, events: List[OrarendEvent], tz: str, now_dt: datetime
+) -> Dict[str, int]:
+    """Diff the parsed events against the calendar and apply the mutations.
+
+    `service` only needs the `events()` part of the Calendar API, so the
+    offline calendar used by replay.py can stand in for the real one.
+    """
+    now = now_dt.isoformat()
+
+    with profiling.stage("calendar_list"):
+        existing = fetch_future_events(service, calendar_id, now)
+        existing_by_uid: Dict[str, Dict] = {}
+        for ev in existing:
+            uid = (
+                ev.get("extendedProperties", {})
+                .get("private", {})
+                .get("elte_orarend_uid")
+            )
+            if uid:
+                existing_by_uid[uid] = ev
 
     current_uids = set()
 
@@ -127,38 +255,39 @@ def sync_events(events: List[OrarendEvent]) -> Dict[str, int]:
     deleted = 0
     unchanged = 0
 
-    for e in events:
-        # Skip events that are in the past or currently in progress.
-        if e.start <= now_dt:
-            continue
-        current_uids.add(e.uid)
-        gcal_event = event_to_gcal(e, tz)
-        if e.uid in existing_by_uid:
-            ev = existing_by_uid[e.uid]
-            # Update only if key fields changed
-            changed = False
-            for key in ("summary", "location", "description", "start", "end"):
-                if ev.get(key) != gcal_event.get(key):
-                    changed = True
-                    break
-            if changed:
-                service.events().update(
-                    calendarId=calendar_id,
-                    eventId=ev["id"],
-                    body=gcal_event,
-                ).execute()
-                updated += 1
+    with profiling.stage("mutations"):
+        for e in events:
+            # Skip events that are in the past or currently in progress.
+            if e.start <= now_dt:
+                continue
+            current_uids.add(e.uid)
+            gcal_event = event_to_gcal(e, tz)
+            if e.uid in existing_by_uid:
+                ev = existing_by_uid[e.uid]
+                # Update only if key fields changed
+                changed = False
+                for key in ("summary", "location", "description", "start", "end"):
+                    if ev.get(key) != gcal_event.get(key):
+                        changed = True
+                        break
+                if changed:
+                    service.events().update(
+                        calendarId=calendar_id,
+                        eventId=ev["id"],
+                        body=gcal_event,
+                    ).execute()
+                    updated += 1
+                else:
+                    unchanged += 1
             else:
-                unchanged += 1
-        else:
-            service.events().insert(calendarId=calendar_id, body=gcal_event).execute()
-            created += 1
-
-    # Delete future events that no longer exist in current scrape
-    for uid, ev in existing_by_uid.items():
-        if uid not in current_uids:
-            service.events().delete(calendarId=calendar_id, eventId=ev["id"]).execute()
-            deleted += 1
+                service.events().insert(calendarId=calendar_id, body=gcal_event).execute()
+                created += 1
+
+        # Delete future events that no longer exist in current scrape
+        for uid, ev in existing_by_uid.items():
+            if uid not in current_uids:
+                service.events().delete(calendarId=calendar_id, eventId=ev["id"]).execute()
+                deleted += 1
 
     return {
         "created": created,